@@ -1,34 +1,79 @@
 import argparse
+import atexit
 import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from pathlib import Path
 from typing import Optional
 
 from lxml import etree
 from strenum import StrEnum
 
-RE_FAILURE = re.compile(r".+?EnergyPlus\/(?P<rel_path>.*):(?P<line_num>\d+)")
-
-
-def write_step_summary(msg):
-    """Print to console and if applicable write to GITHUB_STEP_SUMMARY."""
-    print(msg)
-    if "GITHUB_STEP_SUMMARY" not in os.environ:
+# Very large reports parse without libxml2 size limits; JUnit XML never needs
+# DTD loading, network access, entity resolution or xml:id collection
+_PARSER_OPTIONS = {
+    "huge_tree": True,
+    "load_dtd": False,
+    "no_network": True,
+    "collect_ids": False,
+    "resolve_entities": False,
+    "remove_blank_text": True,
+}
+_XML_PARSER = etree.XMLParser(**_PARSER_OPTIONS)
+
+# Compiled once instead of re-parsing the path expression on every find() call
+_FIND_SYSTEM_OUT = etree.XPath("system-out")
+_FIND_SKIPPED = etree.XPath("skipped")
+_FIND_FAILURE = etree.XPath("failure")
+
+RE_FAILURE = re.compile(
+    r"^.+?EnergyPlus/(?P<rel_path>[^:\n]+):(?P<line_num>\d+).*(?P<msg>(?:\n(?!.*EnergyPlus/).*)*)",
+    re.MULTILINE,
+)
+
+# Markers searched in the raw stdout bytes
+_RUN_MARKER = b"[ RUN      ]"
+_FAILED_MARKER = b"[  FAILED  ]"
+_DISABLED_MARKER = b"YOU HAVE 1 DISABLED TEST"
+
+
+_SUMMARY_PATH = os.environ.get("GITHUB_STEP_SUMMARY")
+_SUMMARY_FILE = None
+
+
+def write_step_summary(*msgs):
+    """Print to console and if applicable write to GITHUB_STEP_SUMMARY.
+
+    Accepts any number of lines so callers can batch them into a single write.
+    The summary file is opened once and kept open for the life of the process.
+    """
+    global _SUMMARY_FILE
+    block = "\n".join(msgs)
+    print(block)
+    if _SUMMARY_PATH is None:
         return
-    with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as f:
-        f.write(msg + "\n")
+    if _SUMMARY_FILE is None:
+        _SUMMARY_FILE = open(_SUMMARY_PATH, "a")
+        atexit.register(_SUMMARY_FILE.close)
+    _SUMMARY_FILE.write(block + "\n")
 
 
 def dict_to_markdown(h: dict, header0: str, header1: str) -> str:
     """Convert a dict to a markdown table."""
-    n0 = max([len(k) for k in h.keys()] + [len(header0)])
-    n1 = max([len(str(v)) for v in h.values()] + [len(header1)])
-
-    content = [
-        f"| {header0.ljust(n0)} | {header1.ljust(n1)} |",
+    items = [(k, str(v)) for k, v in h.items()]
+    n0 = len(header0)
+    n1 = len(header1)
+    for k, v in items:
+        n0 = max(n0, len(k))
+        n1 = max(n1, len(v))
+
+    headers = [
+        f"| {header0:<{n0}} | {header1:<{n1}} |",
         "| " + "-" * n0 + " | " + "-" * n1 + " |",
-    ] + [f"| {k.ljust(n0)} | {str(v).ljust(n1)} |" for k, v in h.items()]
-    return "\n".join(content)
+    ]
+    return "\n".join(chain(headers, (f"| {k:<{n0}} | {v:<{n1}} |" for k, v in items)))
 
 
 class CTestStatus(StrEnum):
@@ -40,7 +85,13 @@ class CTestStatus(StrEnum):
     Fail = "fail"
 
 
+# Constant-time status coercion: CTestStatus(value) scans the members on every call
+_STATUS_MAP = {s.value: s for s in CTestStatus}
+
+
 class GithubAnnotation:
+    __slots__ = ("test_name", "rel_path", "line_num", "reason", "message_lines", "status")
+
     def __init__(
         self,
         test_name: str,
@@ -66,103 +117,182 @@ class GithubAnnotation:
         return f"{self.test_name}, {self.rel_path}:{self.line_num}\n{message}"
 
     def __str__(self):
-        msg = "::warning " if self.status == CTestStatus.Skipped else "::error "
+        parts = ["::warning " if self.status == CTestStatus.Skipped else "::error "]
         if self.rel_path:
-            msg += f"file={self.rel_path},"
+            parts.append(f"file={self.rel_path},")
             if self.line_num:
-                msg += f"line={self.line_num},"
-        msg += f"title={self.test_name}"
+                parts.append(f"line={self.line_num},")
+        parts.append(f"title={self.test_name}")
         if self.reason:
-            msg += f" ({self.reason})"
+            parts.append(f" ({self.reason})")
         if self.message_lines:
-            msg += "::" + "%0A".join(self.message_lines)
+            parts.append("::" + "%0A".join(self.message_lines))
 
-        return msg
+        return "".join(parts)
 
 
 class CTestTestCase:
+    __slots__ = (
+        "test_name",
+        "time",
+        "status",
+        "reason",
+        "_annotations",
+        "system_out_raw",
+        "_system_out",
+        "marked_passed_when_actually_disabled",
+    )
+
     def __init__(self, test_case: etree._Element):
-        self.test_name = test_case.attrib["name"]  # classname is the same
-        self.time = test_case.attrib["time"]
-        self.status = CTestStatus(test_case.attrib["status"])
+        attrib = test_case.attrib
+        self.test_name = attrib["name"]  # classname is the same
+        self.time = attrib["time"]
+        self.status = _STATUS_MAP[attrib["status"]]
         self.reason = None
-        self.annotations = []
+        self._annotations = None
 
-        system_out = test_case.find("system-out")
-        assert system_out is not None
+        system_out_elems = _FIND_SYSTEM_OUT(test_case)
+        assert system_out_elems
+        system_out = system_out_elems[0]
 
-        self.system_out = system_out.text.replace("[NON-XML-CHAR-0x1B]", "\033")
+        # Keep the stdout as the utf-8 bytes libxml2 already has: marker searches
+        # then run on bytes, and we only decode the slices we actually need
+        self.system_out_raw = etree.tostring(system_out, method="text", encoding="utf-8", with_tail=False)
+        self._system_out = None
         self.marked_passed_when_actually_disabled = False
 
         if self.status == CTestStatus.NotRun:
-            skipped = test_case.find("skipped")
-            assert skipped is not None
-            self.reason = skipped.attrib["message"]
+            skipped_elems = _FIND_SKIPPED(test_case)
+            assert skipped_elems
+            self.reason = skipped_elems[0].attrib["message"]
         elif self.status == CTestStatus.Passed:
-            if "YOU HAVE 1 DISABLED TEST" in self.system_out:
+            if _DISABLED_MARKER in self.system_out_raw:
                 self.status = CTestStatus.Skipped
                 self.marked_passed_when_actually_disabled = True
-                self.annotations.append(
-                    GithubAnnotation(test_name=self.test_name, status=self.status, reason="Disabled")
-                )
 
         elif self.status == CTestStatus.Fail:
-            failure = test_case.find("failure")
-            assert failure is not None
-            self.reason = failure.attrib["message"]
-            self.parse_failure_stdout()
+            failure_elems = _FIND_FAILURE(test_case)
+            assert failure_elems
+            self.reason = failure_elems[0].attrib["message"]
+
+    @property
+    def annotations(self):
+        """The GithubAnnotations for this testcase, built on first access.
+
+        Runs without annotations (the common case) never pay for the failure parse.
+        """
+        if self._annotations is None:
+            if self.status == CTestStatus.Fail:
+                self.parse_failure_stdout()
+            elif self.marked_passed_when_actually_disabled:
+                self._annotations = [
+                    GithubAnnotation(test_name=self.test_name, status=self.status, reason="Disabled")
+                ]
+            else:
+                self._annotations = []
+        return self._annotations
+
+    @property
+    def system_out(self):
+        """The testcase stdout, decoded with ESC characters restored, computed on first access."""
+        if self._system_out is None:
+            self._system_out = self.system_out_raw.decode("utf-8").replace("[NON-XML-CHAR-0x1B]", "\033")
+        return self._system_out
 
     def parse_failure_stdout(self):
+        # Locate the failure block on the raw bytes, decode just that slice, then
+        # let the C regex engine scan it in one pass instead of line by line
+        raw = self.system_out_raw
+        start = raw.find(_RUN_MARKER)
+        assert start != -1
+        end = raw.find(_FAILED_MARKER, start)
+        if end == -1:
+            end = len(raw)
+        else:
+            # Exclude the whole [  FAILED  ] line, including any ANSI prefix
+            end = raw.rfind(b"\n", start, end)
+        block = raw[start:end].decode("utf-8").replace("[NON-XML-CHAR-0x1B]", "\033")
+
+        # Failures tend to repeat the same source file and message, so intern them
+        # to share one copy across annotations
+        reason = sys.intern(self.reason) if self.reason else self.reason
         annotations = []
-        annotation = None
-        in_block = False
-        for line in self.system_out.splitlines():
-            if "[ RUN      ]" in line:
-                in_block = True
-                continue
-            if in_block and "[  FAILED  ]" in line:
-                break
-
-            if in_block:
-                if m := RE_FAILURE.match(line):
-                    if annotation is not None:
-                        annotations.append(annotation)
-                    annotation = GithubAnnotation(
-                        test_name=self.test_name,
-                        status=self.status,
-                        rel_path=m.groupdict()["rel_path"],
-                        line_num=m.groupdict()["line_num"],
-                        reason=self.reason,
-                    )
-                    continue
-                annotation.message_lines.append(line)
-
-        assert in_block
-        if annotation:
+        for m in RE_FAILURE.finditer(block):
+            annotation = GithubAnnotation(
+                test_name=self.test_name,
+                status=self.status,
+                rel_path=sys.intern(m["rel_path"]),
+                line_num=m["line_num"],
+                reason=reason,
+            )
+            annotation.message_lines = m["msg"].split("\n")[1:]
             annotations.append(annotation)
-        else:
+
+        if not annotations:
             annotations.append(GithubAnnotation(test_name=self.test_name, status=self.status, reason=self.reason))
-        self.annotations = annotations
+        self._annotations = annotations
 
     def __repr__(self):
         reason = f" ({self.reason})" if self.reason is not None else ""
         return f"{self.test_name} - {self.status.name}{reason}"
 
 
+def _parse_batch(blobs):
+    """Re-parse raw <testcase> blobs into CTestTestCases (runs in a worker process)."""
+    test_cases = [CTestTestCase(test_case=etree.fromstring(blob, _XML_PARSER)) for blob in blobs]
+    for test_case in test_cases:
+        if test_case.status == CTestStatus.Fail:
+            # Force the failure parse here so the regex work happens in the pool,
+            # not lazily in the parent process
+            test_case.annotations
+    return test_cases
+
+
 class CTestInfo:
+    # Below this many testcases the process-spawn overhead isn't worth it
+    PARALLEL_THRESHOLD = 512
+    BATCH_SIZE = 256
+
     def __init__(self, filepath: Path):
         self.filepath = filepath
-        self.tree = etree.parse(str(filepath))
-        self.root_elem = self.tree.getroot()
-        assert self.root_elem.tag == "testsuite"
-        self.n_tests = int(self.root_elem.attrib.get("tests", 0))
-        self.n_failures = int(self.root_elem.attrib.get("failures", 0))
-        self.n_skipped = int(self.root_elem.attrib.get("skipped", 0))
-        self.n_errors = int(self.root_elem.attrib.get("errors", 0))  # this is empty!
 
-        self.test_cases = [CTestTestCase(test_case=test_case) for test_case in self.root_elem]
-
-        n_diff = sum([t.marked_passed_when_actually_disabled for t in self.test_cases])
+        # Grab the counters off the root <testsuite> tag without loading the whole
+        # tree; the tag filter happens in C, like the testcase loop below
+        _, root_elem = next(etree.iterparse(str(filepath), events=("start",), tag="testsuite", **_PARSER_OPTIONS))
+        self.n_tests = int(root_elem.attrib.get("tests", 0))
+        self.n_failures = int(root_elem.attrib.get("failures", 0))
+        self.n_skipped = int(root_elem.attrib.get("skipped", 0))
+        self.n_errors = int(root_elem.attrib.get("errors", 0))  # this is empty!
+
+        # Stream the testcases instead of materializing the full DOM, keeping only
+        # the raw bytes of each one and freeing the libxml2 nodes as we go
+        blobs = []
+        for _, elem in etree.iterparse(str(filepath), events=("end",), tag="testcase", **_PARSER_OPTIONS):
+            blobs.append(etree.tostring(elem))
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        # Each testcase is independent, so large suites fan out over a process pool
+        if len(blobs) >= self.PARALLEL_THRESHOLD and (os.cpu_count() or 1) > 1:
+            batches = [blobs[i : i + self.BATCH_SIZE] for i in range(0, len(blobs), self.BATCH_SIZE)]
+            self.test_cases = []
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                for batch in executor.map(_parse_batch, batches):
+                    self.test_cases += batch
+        else:
+            self.test_cases = _parse_batch(blobs)
+
+        # Bucket by status and count the disabled-but-marked-passed tests in one pass
+        self.failed = []
+        self.skipped = []
+        n_diff = 0
+        for t in self.test_cases:
+            if t.status == CTestStatus.Fail:
+                self.failed.append(t)
+            elif t.status == CTestStatus.Skipped:
+                self.skipped.append(t)
+            n_diff += t.marked_passed_when_actually_disabled
         self.n_skipped += n_diff
 
         self.n_actually_run = self.n_tests - self.n_skipped
@@ -184,32 +314,39 @@ class CTestInfo:
         return f"CTest({self.n_passed}/{self.n_actually_run} ({self.success_rate:.2%}))"
 
     def write_step_summary_table(self):
-        write_step_summary("## CTest Results\n")
-        write_step_summary(f"{self.n_passed}/{self.n_actually_run} ({self.n_skipped} Skipped)\n")
-        write_step_summary(self.summary_table)
-        write_step_summary("")
-        skipped = [t for t in self.test_cases if t.status == CTestStatus.Skipped]
-        failed = [t for t in self.test_cases if t.status == CTestStatus.Fail]
-        if failed:
-            write_step_summary("<details>\n")
-            write_step_summary("<summary>:boom: <strong>Failed Tests</strong> (Click to expand)</summary>")
-            write_step_summary("\n* ".join([""] + [t.__repr__() for t in failed]))
-            write_step_summary("\n</details>\n")
-        if skipped:
-            write_step_summary("<details>\n")
-            write_step_summary("<summary>:warning: <strong>Skipped Tests</strong> (Click to expand)</summary>")
-            write_step_summary("\n* ".join([""] + [t.__repr__() for t in skipped]))
-            write_step_summary("\n</details>\n")
+        lines = [
+            "## CTest Results\n",
+            f"{self.n_passed}/{self.n_actually_run} ({self.n_skipped} Skipped)\n",
+            self.summary_table,
+            "",
+        ]
+        if self.failed:
+            lines += [
+                "<details>\n",
+                "<summary>:boom: <strong>Failed Tests</strong> (Click to expand)</summary>",
+                "\n* ".join(chain([""], (repr(t) for t in self.failed))),
+                "\n</details>\n",
+            ]
+        if self.skipped:
+            lines += [
+                "<details>\n",
+                "<summary>:warning: <strong>Skipped Tests</strong> (Click to expand)</summary>",
+                "\n* ".join(chain([""], (repr(t) for t in self.skipped))),
+                "\n</details>\n",
+            ]
+        write_step_summary(*lines)
 
     def create_github_annotations(self, include_skipped: bool = False):
         keep_statuses = [CTestStatus.Fail]
         if include_skipped:
             keep_statuses.append(CTestStatus.Skipped)
+        lines = []
         for test_case in self.test_cases:
             if test_case.status not in keep_statuses:
                 continue
-            for annotation in test_case.annotations:
-                print(annotation)
+            lines += [str(annotation) for annotation in test_case.annotations]
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":